@@ -1,27 +1,117 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Literal
+from fastapi import FastAPI, HTTPException, Header, Request, Response
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional, Literal
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import queue
+import re
 import traceback
 
 from parsers import regex_parser, llm_parser
+from parsers.batcher import DynBatcher
+from parsers.semcache import SemCache
+
+# Receipts larger than this are regex-parsed in a worker thread
+REGEX_THREAD_THRESHOLD = 10_000
+
+# Concurrent LLM requests arriving within BATCH_MAX_DELAY seconds are
+# sent to Claude together, up to BATCH_MAX_SIZE receipts per call
+BATCH_MAX_SIZE = 8
+BATCH_MAX_DELAY = 0.1
+
+# Limits for POST /batch: receipts per HTTP request, and how many of them
+# are parsed at once
+BATCH_REQUEST_MAX_SIZE = 100
+BATCH_REQUEST_CONCURRENCY = 16
+
+# Receipts in the structured English format regex_parser understands;
+# auto mode tries regex first on these
+_STRUCTURED_PROBE = re.compile(r'TOTAL:\s*\$\d+\.\d+', re.IGNORECASE)
+
+# LLM model used for each accuracy level
+LLM_MODELS = {
+    "fast": llm_parser.ANTHROPIC_MODEL,
+    "accurate": llm_parser.ACCURATE_MODEL
+}
+
+logger = logging.getLogger("receipt_api")
+# Parent of the parser modules' loggers (e.g. cache errors)
+parsers_logger = logging.getLogger("parsers")
+
+# LLM calls currently running, keyed by SHA-256 of the receipt text
+_inflight: Dict[str, asyncio.Task] = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Log through a queue so stream I/O happens on the listener's thread.
+    # QueueHandler.prepare still formats each record (including exc_info
+    # tracebacks) in the calling thread; only the write is offloaded.
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    log_listener = QueueListener(log_queue, logging.StreamHandler())
+    for log in (logger, parsers_logger):
+        log.addHandler(queue_handler)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+    log_listener.start()
+    
+    # Per-worker warm state: one HTTP connection pool to Claude, one cache
+    # connection (and embedding model), and the batchers that use them
+    app.state.llm_client = llm_parser.create_client()
+    app.state.semcache = SemCache.open()
+    
+    # One batcher per model, since a Claude call can only use one model
+    app.state.dyn_batchers = {
+        accuracy: DynBatcher(
+            functools.partial(
+                llm_parser.parse_receipts,
+                model=model,
+                client=app.state.llm_client,
+                cache=app.state.semcache
+            ),
+            max_batch_size=BATCH_MAX_SIZE,
+            max_delay=BATCH_MAX_DELAY
+        )
+        for accuracy, model in LLM_MODELS.items()
+    }
+    for dyn_batcher in app.state.dyn_batchers.values():
+        dyn_batcher.start()
+    yield
+    for dyn_batcher in app.state.dyn_batchers.values():
+        await dyn_batcher.stop()
+    if app.state.llm_client is not None:
+        await app.state.llm_client.close()
+    app.state.semcache.close()
+    
+    log_listener.stop()
+    for log in (logger, parsers_logger):
+        log.removeHandler(queue_handler)
 
 # Create FastAPI app
 app = FastAPI(
     title="Receipt Parser API",
     description="Parse receipts using regex or LLM",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Request model
 class ReceiptRequest(BaseModel):
     receipt_text: str
     parser: Literal["llm", "regex", "auto"] = "auto"
+    accuracy: Literal["fast", "accurate"] = "fast"
     
     class Config:
         json_schema_extra = {
             "example": {
                 "receipt_text": "ACME Office Supplies\nDate: 2024-01-15\nTotal: $71.81",
-                "parser": "auto"
+                "parser": "auto",
+                "accuracy": "fast"
             }
         }
 
@@ -33,34 +123,116 @@ class ReceiptResponse(BaseModel):
     error: Optional[str] = None
     usage: Optional[dict] = None
 
-# Health check endpoint
-@app.get("/")
-def health_check():
-    """Check if API is running"""
-    return {
-        "status": "healthy",
-        "service": "Receipt Parser API",
-        "version": "1.0.0"
-    }
+# Batch request model
+class BatchRequest(BaseModel):
+    requests: List[ReceiptRequest] = Field(..., max_length=BATCH_REQUEST_MAX_SIZE)
 
-# Parse receipt endpoint
-@app.post("/parse", response_model=ReceiptResponse)
-def parse_receipt(request: ReceiptRequest):
-    """
-    Parse a receipt using the specified parser
+# Static responses are serialized once at import
+_HEALTH_BLOB = json.dumps({
+    "status": "healthy",
+    "service": "Receipt Parser API",
+    "version": "1.0.0"
+}).encode()
+_HEALTH_ETAG = hashlib.md5(_HEALTH_BLOB).hexdigest()
+
+_PARSERS_BLOB = json.dumps({
+    "parsers": [
+        {
+            "name": "llm",
+            "description": "Uses Claude AI - handles any language/format",
+            "pros": ["Multi-language", "Flexible", "High accuracy"],
+            "cons": ["Costs money", "Requires API", "Slower"],
+            "accuracy": {
+                "fast": {
+                    "model": LLM_MODELS["fast"],
+                    "description": "Default. Cheapest and lowest latency; accurate enough for most receipts"
+                },
+                "accurate": {
+                    "model": LLM_MODELS["accurate"],
+                    "description": "For hard or messy receipts. Roughly an order of magnitude more expensive and slower"
+                }
+            }
+        },
+        {
+            "name": "regex",
+            "description": "Pattern matching - fast but limited",
+            "pros": ["Free", "Fast", "No API needed"],
+            "cons": ["English only", "Strict format", "Brittle"]
+        },
+        {
+            "name": "auto",
+            "description": "Regex for structured receipts, otherwise tries LLM first and falls back to regex",
+            "pros": ["Best of both worlds", "Resilient", "Free for structured receipts"],
+            "cons": ["Costs money when LLM is used"]
+        }
+    ]
+}).encode()
+_PARSERS_ETAG = hashlib.md5(_PARSERS_BLOB).hexdigest()
+
+def _static_json(request: Request, blob: bytes, etag: str, cache_control: str = "public, max-age=3600") -> Response:
+    """Return a precomputed JSON body, or 304 if the client already has it"""
+    headers = {"ETag": f'"{etag}"', "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=blob, media_type="application/json", headers=headers)
+
+async def _run_regex(receipt_text: str) -> dict:
+    """Run the regex parser, in a worker thread for large receipts"""
+    if len(receipt_text) > REGEX_THREAD_THRESHOLD:
+        return await asyncio.to_thread(regex_parser.parse_receipt, receipt_text)
+    return regex_parser.parse_receipt(receipt_text)
+
+async def _run_llm(receipt_text: str, use_cache: bool, accuracy: str = "fast") -> tuple:
+    """Run the LLM parser; identical receipts already in flight share one call"""
+    key = hashlib.sha256(receipt_text.encode("utf-8")).hexdigest() + ":" + accuracy
+    if not use_cache:
+        key += ":no-cache"
     
-    - **receipt_text**: The raw text from the receipt
-    - **parser**: Which parser to use (llm, regex, or auto)
-        - auto: tries LLM first, falls back to regex if it fails
-    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_call_llm(receipt_text, use_cache, accuracy))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    
+    # Shield so one client disconnecting doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+async def _call_llm(receipt_text: str, use_cache: bool, accuracy: str) -> tuple:
+    """Call the LLM parser, coalescing concurrent requests into batches"""
+    if not use_cache:
+        # Sensitive receipts are never batched with other callers' data
+        return await llm_parser.parse_receipt(
+            receipt_text,
+            use_cache=False,
+            model=LLM_MODELS[accuracy],
+            client=app.state.llm_client
+        )
+    return await app.state.dyn_batchers[accuracy].process_batched(receipt_text)
+
+async def _parse_one(request: ReceiptRequest, use_cache: bool) -> ReceiptResponse:
+    """Parse a single receipt request (shared by /parse and /batch)"""
     
     if not request.receipt_text.strip():
         raise HTTPException(status_code=400, detail="receipt_text cannot be empty")
     
-    # Auto mode: try LLM first, fallback to regex
+    # Auto mode: regex for structured receipts, otherwise try LLM first,
+    # fallback to regex
     if request.parser == "auto":
+        if _STRUCTURED_PROBE.search(request.receipt_text):
+            try:
+                result = await _run_regex(request.receipt_text)
+            except Exception as regex_error:
+                logger.warning("Regex fast path failed, trying LLM", exc_info=regex_error)
+            else:
+                if result["total"] is not None and result["merchant"]:
+                    return ReceiptResponse(
+                        success=True,
+                        parser_used="regex_fastpath",
+                        data=result
+                    )
+        
         try:
-            result, usage = llm_parser.parse_receipt(request.receipt_text)
+            result, usage = await _run_llm(request.receipt_text, use_cache, request.accuracy)
             return ReceiptResponse(
                 success=True,
                 parser_used="llm",
@@ -68,9 +240,9 @@ def parse_receipt(request: ReceiptRequest):
                 usage=usage
             )
         except Exception as llm_error:
-            print(f"LLM failed, falling back to regex: {llm_error}")
+            logger.warning("LLM failed, falling back to regex", exc_info=llm_error)
             try:
-                result = regex_parser.parse_receipt(request.receipt_text)
+                result = await _run_regex(request.receipt_text)
                 return ReceiptResponse(
                     success=True,
                     parser_used="regex_fallback",
@@ -85,7 +257,7 @@ def parse_receipt(request: ReceiptRequest):
     # LLM mode
     elif request.parser == "llm":
         try:
-            result, usage = llm_parser.parse_receipt(request.receipt_text)
+            result, usage = await _run_llm(request.receipt_text, use_cache, request.accuracy)
             return ReceiptResponse(
                 success=True,
                 parser_used="llm",
@@ -101,7 +273,7 @@ def parse_receipt(request: ReceiptRequest):
     # Regex mode
     elif request.parser == "regex":
         try:
-            result = regex_parser.parse_receipt(request.receipt_text)
+            result = await _run_regex(request.receipt_text)
             return ReceiptResponse(
                 success=True,
                 parser_used="regex",
@@ -113,41 +285,110 @@ def parse_receipt(request: ReceiptRequest):
                 detail=f"Regex parsing failed: {str(e)}"
             )
 
+# Health check endpoint
+@app.get("/")
+async def health_check(request: Request):
+    """Check if API is running"""
+    # no-cache: proxies must revalidate, so a dead server is never reported healthy
+    return _static_json(request, _HEALTH_BLOB, _HEALTH_ETAG, cache_control="no-cache")
+
+# Parse receipt endpoint
+@app.post("/parse", response_model=ReceiptResponse)
+async def parse_receipt(request: ReceiptRequest, x_no_cache: Optional[str] = Header(None)):
+    """
+    Parse a receipt using the specified parser
+    
+    - **receipt_text**: The raw text from the receipt
+    - **parser**: Which parser to use (llm, regex, or auto)
+        - auto: uses regex for structured receipts (with a "TOTAL: $" line),
+          otherwise tries LLM first and falls back to regex if it fails
+    - **accuracy**: LLM model to use (fast or accurate, see /parsers)
+    - **X-No-Cache: 1** header: skip the LLM response cache (for sensitive receipts)
+    """
+    
+    use_cache = x_no_cache != "1"
+    
+    return await _parse_one(request, use_cache)
+
+# Batch parse endpoint
+@app.post("/batch", response_model=List[ReceiptResponse])
+async def batch_parse(batch: BatchRequest, x_no_cache: Optional[str] = Header(None)):
+    """
+    Parse many receipts in one HTTP request
+    
+    - **requests**: list of up to BATCH_REQUEST_MAX_SIZE receipt requests,
+      each handled like /parse
+    
+    Receipts are parsed concurrently (at most BATCH_REQUEST_CONCURRENCY at
+    a time) and returned in the same order. A failing receipt gets
+    success=false and an error instead of failing the whole batch.
+    """
+    
+    use_cache = x_no_cache != "1"
+    semaphore = asyncio.Semaphore(BATCH_REQUEST_CONCURRENCY)
+    
+    async def parse_limited(request: ReceiptRequest) -> ReceiptResponse:
+        async with semaphore:
+            return await _parse_one(request, use_cache)
+    
+    outcomes = await asyncio.gather(
+        *[parse_limited(request) for request in batch.requests],
+        return_exceptions=True
+    )
+    
+    responses = []
+    for request, outcome in zip(batch.requests, outcomes):
+        if isinstance(outcome, HTTPException):
+            responses.append(ReceiptResponse(success=False, parser_used=request.parser, error=outcome.detail))
+        elif isinstance(outcome, Exception):
+            responses.append(ReceiptResponse(success=False, parser_used=request.parser, error=str(outcome)))
+        else:
+            responses.append(outcome)
+    
+    return responses
+
 # Compare parsers endpoint
 @app.post("/compare")
-def compare_parsers(request: ReceiptRequest):
+async def compare_parsers(request: ReceiptRequest, x_no_cache: Optional[str] = Header(None)):
     """
     Compare results from both parsers
     """
     
+    use_cache = x_no_cache != "1"
+    
     if not request.receipt_text.strip():
         raise HTTPException(status_code=400, detail="receipt_text cannot be empty")
     
     results = {}
     
-    # Try LLM
+    # Start LLM in the background while regex runs
+    llm_task = asyncio.create_task(
+        _run_llm(request.receipt_text, use_cache, request.accuracy)
+    )
+    
+    # Try Regex
     try:
-        llm_result, usage = llm_parser.parse_receipt(request.receipt_text)
-        results["llm"] = {
+        regex_result = await _run_regex(request.receipt_text)
+        results["regex"] = {
             "success": True,
-            "data": llm_result,
-            "usage": usage
+            "data": regex_result
         }
     except Exception as e:
-        results["llm"] = {
+        results["regex"] = {
             "success": False,
             "error": str(e)
         }
     
-    # Try Regex
+    # Try LLM
     try:
-        regex_result = regex_parser.parse_receipt(request.receipt_text)
-        results["regex"] = {
+        llm_result, usage = await llm_task
+        results["llm"] = {
             "success": True,
-            "data": regex_result
+            "data": llm_result,
+            "usage": usage
         }
     except Exception as e:
-        results["regex"] = {
+        results["llm"] = {
             "success": False,
             "error": str(e)
         }
@@ -170,27 +411,6 @@ def compare_parsers(request: ReceiptRequest):
 
 # Get parser info
 @app.get("/parsers")
-def get_parsers_info():
+async def get_parsers_info(request: Request):
     """Get information about available parsers"""
-    return {
-        "parsers": [
-            {
-                "name": "llm",
-                "description": "Uses Claude AI - handles any language/format",
-                "pros": ["Multi-language", "Flexible", "High accuracy"],
-                "cons": ["Costs money", "Requires API", "Slower"]
-            },
-            {
-                "name": "regex",
-                "description": "Pattern matching - fast but limited",
-                "pros": ["Free", "Fast", "No API needed"],
-                "cons": ["English only", "Strict format", "Brittle"]
-            },
-            {
-                "name": "auto",
-                "description": "Tries LLM first, falls back to regex",
-                "pros": ["Best of both worlds", "Resilient"],
-                "cons": ["Costs money when LLM is used"]
-            }
-        ]
-    }
\ No newline at end of file
+    return _static_json(request, _PARSERS_BLOB, _PARSERS_ETAG)
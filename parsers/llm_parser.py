@@ -1,34 +1,85 @@
 import anthropic
-import json
+import asyncio
+import logging
+import orjson
 import os
 import re
 from dotenv import load_dotenv
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Tuple, Union, cast
+
+from parsers.semcache import SemCache
 
 load_dotenv()
 
-def parse_receipt(receipt_text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+logger = logging.getLogger(__name__)
+
+# Haiku is accurate enough for receipt extraction at a fraction of Sonnet's
+# cost and latency; requests can opt into ACCURATE_MODEL for hard receipts
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-haiku-4-5")
+ACCURATE_MODEL = os.getenv("ANTHROPIC_ACCURATE_MODEL", "claude-sonnet-4-20250514")
+
+# Output token budget per receipt (receipt JSON is typically < 300 tokens)
+MAX_TOKENS = int(os.getenv("ANTHROPIC_MAX_TOKENS", "512"))
+
+# Per-attempt timeout (seconds) and backoff delays between retries
+REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "8.0"))
+RETRY_DELAYS = (0.5, 1.5)
+
+# A batched call gets REQUEST_TIMEOUT plus a small allowance per extra
+# receipt, capped at BATCH_TIMEOUT_MAX, and a single attempt: if it fails,
+# each receipt is retried on its own instead
+BATCH_TIMEOUT_PER_RECEIPT = 0.5
+BATCH_TIMEOUT_MAX = 12.0
+
+# Markdown code fence around the JSON response
+_FENCE_RE = re.compile(r'```(?:json)?\s*\n(.*?)\n```', re.DOTALL)
+
+_API_KEY = os.getenv("ANTHROPIC_API_KEY")
+
+def create_client() -> Optional[anthropic.AsyncAnthropic]:
     """
-    Parse receipt using Claude AI.
-    
-    Returns:
-        Tuple of (parsed_data, usage_stats)
+    Create an async Claude client, or None if ANTHROPIC_API_KEY is not set.
+
+    Retries are handled by _create_message, so the SDK's own retries are
+    disabled.
     """
-    
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    
-    if not api_key:
-        raise ValueError("ANTHROPIC_API_KEY not found!")
-    
-    client = anthropic.Anthropic(api_key=api_key)
-    
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1024,
-        messages=[
-            {
-                "role": "user",
-                "content": f"""Extract structured data from this receipt and return ONLY valid JSON.
+    if not _API_KEY:
+        return None
+    return anthropic.AsyncAnthropic(
+        api_key=_API_KEY,
+        max_retries=0,
+        timeout=anthropic.Timeout(10.0, connect=2.0)
+    )
+
+# Default client for callers that don't pass their own, created on first
+# use (one per process, so httpx keeps its connection pool warm)
+_client: Optional[anthropic.AsyncAnthropic] = None
+
+# Response cache, opened on first use
+_cache: Optional[SemCache] = None
+
+# Short instructions for models whose minimum cacheable prefix is out of
+# reach (4096 tokens for Haiku 4.5); padding them to that length would cost
+# more than it saves, so they are sent uncached.
+SHORT_PROMPT = """Extract structured data from the receipt in the next user message and return ONLY valid JSON.
+
+Required fields:
+- merchant: string
+- date: string (YYYY-MM-DD format if possible)
+- invoice_number: string or null
+- items: array of objects with description and amount
+- subtotal: number or null
+- tax: number or null
+- total: number
+
+If the message contains several receipts labelled "Receipt 1:", "Receipt 2:" and so on, return a JSON array with one object per receipt, each with an extra "id" field set to that receipt's number (1 for "Receipt 1:", 2 for "Receipt 2:", ...).
+
+Important: Return ONLY the JSON object (or array of objects), no markdown, no explanations."""
+
+# Fixed instructions sent as a cached system block to models whose minimum
+# cacheable prefix (1024 tokens for Sonnet) this ~1.2k-token prompt meets,
+# so the schema examples are kept inline.
+SCHEMA_PROMPT = """You are a receipt parsing assistant. You receive the raw text of a single receipt or invoice, which may come from OCR, a point-of-sale printout, an email or a copy-pasted document, and may be written in any language (English, German, Spanish, French, ...). Your job is to extract structured data from it and return ONLY valid JSON.
 
 Required fields:
 - merchant: string
@@ -39,31 +90,398 @@ Required fields:
 - tax: number or null
 - total: number
 
+Field rules:
+- merchant: the name of the store or business that issued the receipt. This is usually the first non-empty line. Do not include the street address, city, phone number or tax ID in the merchant name. Keep the original spelling and capitalisation.
+- date: the transaction date. Convert it to YYYY-MM-DD when the day, month and year can be determined unambiguously. European receipts usually write DD.MM.YYYY or DD/MM/YYYY; US receipts usually write MM/DD/YYYY. If the format is ambiguous, prefer the convention of the receipt's language. If no date is present, use null.
+- invoice_number: the invoice, receipt, bill or transaction number, exactly as printed (for example "INV-2024-001", "Beleg-Nr: 8821-5531" becomes "8821-5531"). Use null if there is none.
+- items: one object per purchased line item, in the order they appear on the receipt. Each object has exactly two keys: "description" (string, the item name including any quantity or size information printed with it) and "amount" (number, the line total for that item). Do not include subtotal, tax, discount summary, payment or change lines as items.
+- subtotal: the amount before tax, if printed. Use null if the receipt does not show one.
+- tax: the tax amount (VAT, MwSt, IVA, sales tax), if printed. If several tax lines are present, use their sum. Use null if the receipt does not show any tax.
+- total: the final amount paid. This field is required.
+
+Number formatting:
+- All monetary values must be JSON numbers, not strings.
+- Strip currency symbols and codes ($, €, £, USD, EUR, ...).
+- Receipts may use a comma as the decimal separator (e.g. "1,29€" means 1.29). Always output a dot as the decimal separator.
+- Do not round or recompute values; copy the amounts printed on the receipt.
+
+Example 1
+Receipt text:
+ACME Office Supplies
+123 Business St, New York
+Date: 2024-01-15
+Invoice #: INV-2024-001
+
+Items:
+- Paper (A4, 5 reams) ... $45.00
+- Pens (Blue, pack of 12) ... $8.50
+- Stapler ... $12.99
+
+Subtotal: $66.49
+Tax (8%): $5.32
+TOTAL: $71.81
+
+Thank you for your business!
+
+Output:
+{"merchant": "ACME Office Supplies", "date": "2024-01-15", "invoice_number": "INV-2024-001", "items": [{"description": "Paper (A4, 5 reams)", "amount": 45.00}, {"description": "Pens (Blue, pack of 12)", "amount": 8.50}, {"description": "Stapler", "amount": 12.99}], "subtotal": 66.49, "tax": 5.32, "total": 71.81}
+
+Example 2
 Receipt text:
-{receipt_text}
+REWE Supermarkt
+Berlin Mitte
+
+Datum: 16.01.2024
+Beleg-Nr: 8821-5531
+
+Artikel:
+- Vollmilch 1L          1,29€
+- Schwarzbrot           2,49€
+- Äpfel 1kg             3,99€
+
+Zwischensumme:          7,77€
+MwSt (7%):              0,51€
+GESAMT:                 8,28€
+
+Output:
+{"merchant": "REWE Supermarkt", "date": "2024-01-16", "invoice_number": "8821-5531", "items": [{"description": "Vollmilch 1L", "amount": 1.29}, {"description": "Schwarzbrot", "amount": 2.49}, {"description": "Äpfel 1kg", "amount": 3.99}], "subtotal": 7.77, "tax": 0.51, "total": 8.28}
+
+Example 3
+Receipt text:
+Joe's Coffee
+1/17/2024
+
+2 Lattes - $9.00
+Muffin - $3.50
+Bagel - $2.75
+
+Total: $15.25
 
-Important: Return ONLY the JSON object, no markdown, no explanations."""
+Output:
+{"merchant": "Joe's Coffee", "date": "2024-01-17", "invoice_number": null, "items": [{"description": "2 Lattes", "amount": 9.00}, {"description": "Muffin", "amount": 3.50}, {"description": "Bagel", "amount": 2.75}], "subtotal": null, "tax": null, "total": 15.25}
+
+Example 4
+Receipt text:
+Mercadona S.A.
+Madrid Centro
+
+Fecha: 18/01/2024
+
+Productos:
+- Pan integral     1,50€
+- Leche            0,99€
+- Queso            3,45€
+
+Total:             5,94€
+
+Output:
+{"merchant": "Mercadona S.A.", "date": "2024-01-18", "invoice_number": null, "items": [{"description": "Pan integral", "amount": 1.50}, {"description": "Leche", "amount": 0.99}, {"description": "Queso", "amount": 3.45}], "subtotal": null, "tax": null, "total": 5.94}
+
+The next user message contains the receipt text to parse. If it contains several receipts labelled "Receipt 1:", "Receipt 2:" and so on, return a JSON array with one object per receipt, each with an extra "id" field set to that receipt's number (1 for "Receipt 1:", 2 for "Receipt 2:", ...).
+
+Important: Return ONLY the JSON object (or array of objects), no markdown, no explanations."""
+
+def _system_blocks(model: str) -> List[Dict[str, Any]]:
+    """System prompt for model, with cache_control only where it can be cached"""
+    if "sonnet" in model:
+        return [{"type": "text", "text": SCHEMA_PROMPT, "cache_control": {"type": "ephemeral"}}]
+    return [{"type": "text", "text": SHORT_PROMPT}]
+
+def _get_client() -> Optional[anthropic.AsyncAnthropic]:
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+def _get_cache() -> SemCache:
+    global _cache
+    if _cache is None:
+        _cache = SemCache.open()
+    return _cache
+
+async def _stream_message(
+    client: anthropic.AsyncAnthropic,
+    user_content: str,
+    model: str,
+    max_tokens: int
+) -> Tuple[str, Any]:
+    """
+    Stream one response from Claude and return (response_text, final_message).
+
+    The stream is aborted as soon as the first non-blank output shows the
+    response is not JSON (e.g. a "Sure, here is..." preamble), instead of
+    waiting for the rest of it.
+    """
+
+    chunks: List[str] = []
+    checked = False
+
+    async with client.messages.stream(
+        model=model,
+        max_tokens=max_tokens,
+        system=_system_blocks(model),
+        messages=[
+            {
+                "role": "user",
+                "content": user_content
             }
         ]
-    )
-    
-    response_text = message.content[0].text.strip()
-    
+    ) as stream:
+        async for text in stream.text_stream:
+            chunks.append(text)
+            if not checked:
+                head = "".join(chunks).lstrip()
+                if head:
+                    if head[0] not in "{[`":
+                        raise ValueError(f"LLM response is not JSON: {head[:40]!r}")
+                    checked = True
+        message = await stream.get_final_message()
+
+    return "".join(chunks), message
+
+async def _create_message(
+    client: Optional[anthropic.AsyncAnthropic],
+    user_content: str,
+    model: str,
+    max_tokens: int,
+    request_timeout: float,
+    retry_delays: Tuple[float, ...] = RETRY_DELAYS
+) -> Tuple[str, Any]:
+    """
+    Call the messages API with a per-attempt timeout.
+
+    Timeouts, connection errors, rate limits (429) and server errors
+    (5xx, including 529 overloaded) are retried after each of
+    retry_delays; the last error is re-raised so callers can fall back to
+    regex.
+    """
+
+    if client is None:
+        client = _get_client()
+    if client is None:
+        raise ValueError("ANTHROPIC_API_KEY not found!")
+
+    for attempt in range(len(retry_delays) + 1):
+        try:
+            return await asyncio.wait_for(
+                _stream_message(client, user_content, model, max_tokens),
+                timeout=request_timeout
+            )
+        except (asyncio.TimeoutError, anthropic.APIConnectionError, anthropic.APIStatusError) as e:
+            if isinstance(e, anthropic.APIStatusError) and e.status_code != 429 and e.status_code < 500:
+                raise
+            if attempt == len(retry_delays):
+                raise
+            await asyncio.sleep(retry_delays[attempt])
+
+def _postprocess(response_text: str) -> Any:
+    """Strip an optional markdown fence and decode the JSON response"""
+
+    response_text = response_text.strip()
+
     # Remove markdown code blocks if present
     if response_text.startswith("```"):
-        match = re.search(r'```(?:json)?\s*\n(.*?)\n```', response_text, re.DOTALL)
+        match = _FENCE_RE.search(response_text)
         if match:
             response_text = match.group(1)
-    
-    result = json.loads(response_text)
-    result["parser_used"] = "llm"
-    
-    # Extract usage stats
+
+    # orjson accepts str directly, no need to encode first
+    return orjson.loads(response_text)
+
+async def _request(
+    client: Optional[anthropic.AsyncAnthropic],
+    user_content: str,
+    model: str,
+    max_tokens: int,
+    request_timeout: float,
+    retry_delays: Tuple[float, ...] = RETRY_DELAYS
+) -> Tuple[Any, Dict[str, Any]]:
+    """Send one message to Claude and return (decoded_json, usage_stats)"""
+
+    response_text, message = await _create_message(
+        client, user_content, model, max_tokens, request_timeout, retry_delays
+    )
+
+    # Output is capped at MAX_TOKENS per receipt (a few KB even for a full
+    # batch), which orjson decodes far faster than a thread hand-off
+    data = _postprocess(response_text)
+
+    # Extract usage stats (cache fields are None on older SDKs / uncached calls)
+    cache_read = getattr(message.usage, "cache_read_input_tokens", None) or 0
+    cache_creation = getattr(message.usage, "cache_creation_input_tokens", None) or 0
     usage = {
+        "model": model,
         "input_tokens": message.usage.input_tokens,
         "output_tokens": message.usage.output_tokens,
-        "total_tokens": message.usage.input_tokens + message.usage.output_tokens
+        "total_tokens": message.usage.input_tokens + message.usage.output_tokens,
+        "cache_read_input_tokens": cache_read,
+        "cache_creation_input_tokens": cache_creation
     }
-    
+
+    return data, usage
+
+async def _cache_get(cache: SemCache, receipt_text: str, model: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """Look up receipt_text in the cache; a cache error counts as a miss"""
+    # sqlite and embedding work is blocking, keep it off the event loop
+    try:
+        return await asyncio.to_thread(cache.get, receipt_text, model)
+    except Exception:
+        logger.warning("Cache lookup failed, treating as a miss", exc_info=True)
+        return None
+
+async def _cache_put(cache: SemCache, receipt_text: str, model: str, result: Dict[str, Any]) -> None:
+    """Store result in the cache; a cache error only skips the write"""
+    try:
+        await asyncio.to_thread(cache.put, receipt_text, model, result)
+    except Exception:
+        logger.warning("Cache write failed, result not cached", exc_info=True)
+
+def _split_by_id(parsed: Any, count: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Order a batched response by the "id" of each object.
+
+    Returns the objects for ids 1..count in order, with the id removed, or
+    None unless the response holds exactly one object for each id.
+    """
+    if not isinstance(parsed, list) or len(parsed) != count:
+        return None
+    if not all(isinstance(result, dict) for result in parsed):
+        return None
+
+    # Accept "1" as well as 1; anything else fails the id check
+    by_id = {str(result.get("id")): result for result in parsed}
+    ids = [str(n) for n in range(1, count + 1)]
+    if set(by_id) != set(ids):
+        return None
+
+    ordered = [by_id[receipt_id] for receipt_id in ids]
+    for result in ordered:
+        del result["id"]
+    return ordered
+
+async def _parse_uncached(
+    receipt_text: str,
+    use_cache: bool,
+    request_timeout: float,
+    model: str,
+    client: Optional[anthropic.AsyncAnthropic],
+    cache: Optional[SemCache]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Send a single receipt to Claude and store the result in the cache"""
+
+    result, usage = await _request(client, receipt_text, model, MAX_TOKENS, request_timeout)
+    result["parser_used"] = "llm"
+
+    if use_cache:
+        await _cache_put(cache, receipt_text, model, result)
+
     return result, usage
-  
\ No newline at end of file
+
+async def parse_receipt(
+    receipt_text: str,
+    use_cache: bool = True,
+    request_timeout: float = REQUEST_TIMEOUT,
+    model: str = ANTHROPIC_MODEL,
+    client: Optional[anthropic.AsyncAnthropic] = None,
+    cache: Optional[SemCache] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Parse receipt using Claude AI.
+
+    Identical or near-identical receipts previously parsed by the same
+    model are served from the semantic cache unless use_cache is False.
+    Each API attempt is limited to request_timeout seconds and retried
+    twice before giving up. client and cache default to process-wide
+    instances created on first use.
+
+    Returns:
+        Tuple of (parsed_data, usage_stats)
+    """
+
+    if use_cache and cache is None:
+        cache = _get_cache()
+
+    if use_cache:
+        cached = await _cache_get(cache, receipt_text, model)
+        if cached is not None:
+            return cached
+
+    return await _parse_uncached(receipt_text, use_cache, request_timeout, model, client, cache)
+
+async def parse_receipts(
+    receipt_texts: List[str],
+    use_cache: bool = True,
+    request_timeout: float = REQUEST_TIMEOUT,
+    model: str = ANTHROPIC_MODEL,
+    client: Optional[anthropic.AsyncAnthropic] = None,
+    cache: Optional[SemCache] = None
+) -> List[Union[Tuple[Dict[str, Any], Dict[str, Any]], Exception]]:
+    """
+    Parse several receipts with a single Claude call.
+
+    Cache hits are answered directly; the remaining receipts are sent
+    together as "Receipt 1: ...", "Receipt 2: ..." and Claude returns a
+    JSON array whose objects carry the matching "id", so results are
+    split back by id rather than position. Every receipt in the call gets
+    the call's usage stats plus a batch_size field. The batched call is
+    tried once with a capped timeout; if it fails or the ids don't match
+    1..n exactly, each receipt is retried on its own.
+
+    Returns:
+        List with one (parsed_data, usage_stats) tuple per input receipt,
+        or the exception raised while parsing that receipt
+    """
+
+    results: List[Union[Tuple[Dict[str, Any], Dict[str, Any]], Exception, None]] = [None] * len(receipt_texts)
+
+    if use_cache and cache is None:
+        cache = _get_cache()
+
+    if use_cache:
+        for i, receipt_text in enumerate(receipt_texts):
+            results[i] = await _cache_get(cache, receipt_text, model)
+
+    pending = [i for i, cached in enumerate(results) if cached is None]
+
+    if len(pending) == 1:
+        i = pending[0]
+        try:
+            results[i] = await _parse_uncached(receipt_texts[i], use_cache, request_timeout, model, client, cache)
+        except Exception as e:
+            results[i] = e
+    elif pending:
+        user_content = "\n\n".join(
+            f"Receipt {n}:\n{receipt_texts[i]}" for n, i in enumerate(pending, 1)
+        )
+        # Output, and so generation time, grows with the number of receipts
+        batch_timeout = min(
+            request_timeout + BATCH_TIMEOUT_PER_RECEIPT * (len(pending) - 1),
+            BATCH_TIMEOUT_MAX
+        )
+        split: Optional[List[Dict[str, Any]]] = None
+        try:
+            parsed, usage = await _request(
+                client, user_content, model, MAX_TOKENS * len(pending), batch_timeout, retry_delays=()
+            )
+            split = _split_by_id(parsed, len(pending))
+        except Exception:
+            logger.warning("Batched LLM call failed, parsing receipts one by one", exc_info=True)
+
+        if split is not None:
+            usage["batch_size"] = len(pending)
+            for i, result in zip(pending, split):
+                result["parser_used"] = "llm"
+                results[i] = (result, usage)
+                if use_cache:
+                    await _cache_put(cache, receipt_texts[i], model, result)
+        else:
+            # Failed call or ids that don't match: parse each receipt on its own
+            # so one bad response doesn't fail every caller in the batch
+            outcomes = await asyncio.gather(
+                *(_parse_uncached(receipt_texts[i], use_cache, request_timeout, model, client, cache) for i in pending),
+                return_exceptions=True
+            )
+            for i, outcome in zip(pending, outcomes):
+                results[i] = outcome
+
+    return cast(List[Union[Tuple[Dict[str, Any], Dict[str, Any]], Exception]], results)
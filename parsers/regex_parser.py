@@ -1,5 +1,26 @@
 import re
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+
+# Patterns are compiled once at import.
+# All header/footer fields are found in a single pass; the group name
+# of each alternative is the result key it fills. Each alternative is a
+# lookahead, so matches are zero-width and one field's value can't swallow
+# the next field on the same line (e.g. "Date: ...   Invoice #: ...").
+_FIELDS_RE = re.compile(
+    r"(?=Date:\s*(?P<date>.+))"
+    r"|(?=Invoice #:\s*(?P<invoice_number>.+))"
+    r"|(?=TOTAL:\s*\$(?P<total>\d+\.\d+))"
+    r"|(?=Subtotal:\s*\$(?P<subtotal>\d+\.\d+))"
+    r"|(?=Tax.*?:\s*\$(?P<tax>\d+\.\d+))"
+)
+_TEXT_FIELDS = ("date", "invoice_number")
+
+# Line-scoped patterns; [^\S\n] is whitespace that does not cross a line break
+_LINE_RE = re.compile(r'^[^\n]*', re.MULTILINE)
+_ITEM_LINE_RE = re.compile(
+    r'^[^\S\n]*-[^\S\n]*(.+?)[^\S\n]*\.\.\.[^\S\n]*\$(\d+\.\d+)',
+    re.MULTILINE
+)
 
 def parse_receipt(receipt_text: str) -> Dict[str, Any]:
     """
@@ -7,61 +28,40 @@ def parse_receipt(receipt_text: str) -> Dict[str, Any]:
     Only works for structured English receipts!
     """
     
-    result = {
+    # Locals are annotated so the module compiles cleanly with mypyc
+    items: List[Dict[str, Any]] = []
+    result: Dict[str, Any] = {
         "merchant": None,
         "date": None,
         "invoice_number": None,
-        "items": [],
+        "items": items,
         "subtotal": None,
         "tax": None,
         "total": None,
         "parser_used": "regex"  # Track which parser was used
     }
     
-    lines = receipt_text.strip().split('\n')
-    
     # Extract merchant (first non-empty line)
-    for line in lines:
-        if line.strip():
-            result["merchant"] = line.strip()
+    for line_match in _LINE_RE.finditer(receipt_text):
+        line: str = line_match.group().strip()
+        if line:
+            result["merchant"] = line
             break
     
-    # Extract date
-    date_match = re.search(r"Date:\s*(.+)", receipt_text)
-    if date_match:
-        result["date"] = date_match.group(1).strip()
-    
-    # Extract invoice number
-    invoice_match = re.search(r"Invoice #:\s*(.+)", receipt_text)
-    if invoice_match:
-        result["invoice_number"] = invoice_match.group(1).strip()
-    
-    # Extract total
-    total_match = re.search(r"TOTAL:\s*\$(\d+\.\d+)", receipt_text)
-    if total_match:
-        result["total"] = float(total_match.group(1))
-    
-    # Extract subtotal
-    subtotal_match = re.search(r"Subtotal:\s*\$(\d+\.\d+)", receipt_text)
-    if subtotal_match:
-        result["subtotal"] = float(subtotal_match.group(1))
-    
-    # Extract tax
-    tax_match = re.search(r"Tax.*?:\s*\$(\d+\.\d+)", receipt_text)
-    if tax_match:
-        result["tax"] = float(tax_match.group(1))
+    # Extract date, invoice number, total, subtotal and tax (first match wins)
+    for match in _FIELDS_RE.finditer(receipt_text):
+        name: Optional[str] = match.lastgroup
+        if name is None or result[name] is not None:
+            continue
+        value: str = match.group(name)
+        result[name] = value.strip() if name in _TEXT_FIELDS else float(value)
     
     # Extract line items
-    for line in lines:
-        if line.strip().startswith('-'):
-            item_match = re.search(r'-\s*(.+?)\s*\.\.\.\s*\$(\d+\.\d+)', line)
-            if item_match:
-                description = item_match.group(1).strip()
-                amount = float(item_match.group(2))
-                result["items"].append({
-                    "description": description,
-                    "amount": amount
-                })
+    for item_match in _ITEM_LINE_RE.finditer(receipt_text):
+        items.append({
+            "description": item_match.group(1).strip(),
+            "amount": float(item_match.group(2))
+        })
     
     return result
 
@@ -0,0 +1,141 @@
+import hashlib
+import orjson
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional, Tuple
+
+# Optional: vector lookup needs both sqlite-vec and sentence-transformers.
+# Without them the cache still serves byte-identical receipts via SHA-256.
+try:
+    import sqlite_vec
+except ImportError:
+    sqlite_vec = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+CACHE_PATH = os.getenv("SEMCACHE_PATH", "cache.db")
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+TTL_SECONDS = 24 * 60 * 60
+MAX_DISTANCE = 0.05
+
+# Receipts that differ only in an amount or date embed almost identically,
+# so a semantic hit also requires the same sequence of numeric tokens
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+class SemCache:
+    """
+    Semantic response cache for LLM parser results.
+
+    Rows are (sha256, llm_model, numbers, embedding, parsed_json) in
+    sqlite. Lookups only consider rows produced by the same LLM model and
+    try an exact hash match first, then the nearest embedding by cosine
+    distance among rows with the same numeric tokens. Safe to share
+    between threads.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, model=None):
+        self.conn = conn
+        self.model = model
+        self._lock = threading.Lock()
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_responses (
+                sha256 TEXT NOT NULL,
+                llm_model TEXT NOT NULL,
+                numbers TEXT NOT NULL,
+                embedding BLOB,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, llm_model)
+            )"""
+        )
+        self.conn.commit()
+
+    @classmethod
+    def open(cls, path: str = CACHE_PATH) -> "SemCache":
+        """Open (or create) the cache database at path"""
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets several worker processes read while one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        model = None
+        if sqlite_vec is not None and SentenceTransformer is not None:
+            conn.enable_load_extension(True)
+            sqlite_vec.load(conn)
+            conn.enable_load_extension(False)
+            model = SentenceTransformer(EMBEDDING_MODEL)
+
+        return cls(conn, model)
+
+    def _embed(self, receipt_text: str) -> Optional[bytes]:
+        if self.model is None:
+            return None
+        vector = self.model.encode(receipt_text, normalize_embeddings=True)
+        return sqlite_vec.serialize_float32(vector.tolist())
+
+    @staticmethod
+    def _numbers(receipt_text: str) -> str:
+        return " ".join(_NUMBER_RE.findall(receipt_text))
+
+    def get(self, receipt_text: str, llm_model: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """
+        Look up a cached result for receipt_text parsed by llm_model.
+
+        Returns:
+            Tuple of (parsed_data, usage_stats) or None on a miss
+        """
+
+        cutoff = time.time() - TTL_SECONDS
+        key = hashlib.sha256(receipt_text.encode("utf-8")).hexdigest()
+
+        # Exact fast path for byte-identical receipts
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT result FROM llm_responses WHERE sha256 = ? AND llm_model = ? AND created_at > ?",
+                (key, llm_model, cutoff)
+            ).fetchone()
+        if row:
+            return orjson.loads(row[0]), {"cache": "exact_hit"}
+
+        embedding = self._embed(receipt_text)
+        if embedding is None:
+            return None
+
+        with self._lock:
+            row = self.conn.execute(
+                """SELECT result, vec_distance_cosine(embedding, ?) AS distance
+                   FROM llm_responses
+                   WHERE embedding IS NOT NULL AND llm_model = ? AND numbers = ? AND created_at > ?
+                   ORDER BY distance
+                   LIMIT 1""",
+                (embedding, llm_model, self._numbers(receipt_text), cutoff)
+            ).fetchone()
+        if row and row[1] < MAX_DISTANCE:
+            return orjson.loads(row[0]), {"cache": "semantic_hit"}
+
+        return None
+
+    def put(self, receipt_text: str, llm_model: str, result: Dict[str, Any]) -> None:
+        """Store a parsed result, replacing any previous entry for the same text and model"""
+        key = hashlib.sha256(receipt_text.encode("utf-8")).hexdigest()
+        embedding = self._embed(receipt_text)
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM llm_responses WHERE created_at <= ?",
+                (time.time() - TTL_SECONDS,)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, llm_model, self._numbers(receipt_text), embedding, orjson.dumps(result).decode(), time.time())
+            )
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,19 @@
+"""
+Optional native build of the regex parser.
+
+    pip install mypy
+    python setup.py build_ext --inplace
+
+This compiles parsers/regex_parser.py with mypyc into an extension module
+next to the source; `from parsers import regex_parser` picks it up
+automatically. Delete the generated .so files to go back to pure Python.
+"""
+
+from setuptools import setup
+from mypyc.build import mypycify
+
+setup(
+    name="receipt-parser-comparison",
+    packages=["parsers"],
+    ext_modules=mypycify(["parsers/regex_parser.py"]),
+)
@@ -1,3 +1,4 @@
+import asyncio
 from parsers.llm_parser import parse_receipt
 
 receipt = """
@@ -7,7 +8,7 @@ Total: $71.81
 """
 
 try:
-    result, usage = parse_receipt(receipt)
+    result, usage = asyncio.run(parse_receipt(receipt, use_cache=False))
     print("✅ LLM parser works!")
     print(result)
 except Exception as e:
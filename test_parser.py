@@ -1,88 +1,87 @@
 import os
 import json
+import asyncio
 import argparse
 from pathlib import Path
 from parsers import regex_parser, llm_parser
 
+# Maximum number of receipts parsed at the same time
+CONCURRENCY = 8
+
 def load_receipt(filepath):
     """Load receipt text from a file"""
     with open(filepath, 'r', encoding='utf-8') as f:
         return f.read()
 
-def compare_parsers(filepath, verbose=True):
-    """Compare both parsers on the same receipt"""
-    
-    if verbose:
-        print("\n" + "=" * 70)
-        print(f"📄 Testing: {filepath}")
-        print("=" * 70)
+async def compare_parsers(filepath):
+    """Run both parsers on the same receipt"""
     
     # Load receipt
     receipt_text = load_receipt(filepath)
     
-    if verbose:
-        print("\n📝 Original Receipt:")
-        print("-" * 70)
-        preview = receipt_text[:150] + "..." if len(receipt_text) > 150 else receipt_text
-        print(preview)
-        print("-" * 70)
-    
     results = {}
     
     # Test Regex Parser
-    if verbose:
-        print("\n🔧 REGEX PARSER:")
-        print("-" * 70)
-    
     try:
         result_regex = regex_parser.parse_receipt(receipt_text)
-        total = result_regex.get('total', None)
-        items_count = len(result_regex.get('items', []))
-        
-        if verbose:
-            print(f"✅ Success")
-            print(f"   Merchant: {result_regex.get('merchant', 'N/A')}")
-            print(f"   Items: {items_count}")
-            if total is not None:
-                print(f"   💰 Total: ${total:.2f}")
-            else:
-                print(f"   💰 Total: N/A")
-        
         results['regex'] = {'success': True, 'data': result_regex}
     except Exception as e:
-        if verbose:
-            print(f"❌ Failed: {e}")
         results['regex'] = {'success': False, 'error': str(e)}
     
     # Test LLM Parser
-    if verbose:
-        print("\n🤖 LLM PARSER:")
-        print("-" * 70)
-    
     try:
-        result_llm, usage = llm_parser.parse_receipt(receipt_text)
-        total = result_llm.get('total', None)
-        items_count = len(result_llm.get('items', []))
-        
-        if verbose:
-            print(f"✅ Success")
-            print(f"   Merchant: {result_llm.get('merchant', 'N/A')}")
-            print(f"   Items: {items_count}")
-            if total is not None:
-                print(f"   💰 Total: ${total:.2f}")
-            else:
-                print(f"   💰 Total: N/A")
-        
+        result_llm, usage = await llm_parser.parse_receipt(receipt_text, use_cache=False)
         results['llm'] = {
             'success': True, 
             'data': result_llm,
             'usage': usage
         }
     except Exception as e:
-        if verbose:
-            print(f"❌ Failed: {e}")
         results['llm'] = {'success': False, 'error': str(e)}
     
+    return results
+
+def print_parser_result(result):
+    """Print the outcome of a single parser"""
+    if not result['success']:
+        print(f"❌ Failed: {result['error']}")
+        return
+    
+    data = result['data']
+    total = data.get('total', None)
+    items_count = len(data.get('items', []))
+    
+    print(f"✅ Success")
+    print(f"   Merchant: {data.get('merchant', 'N/A')}")
+    print(f"   Items: {items_count}")
+    if total is not None:
+        print(f"   💰 Total: ${total:.2f}")
+    else:
+        print(f"   💰 Total: N/A")
+
+def print_comparison(filepath, results, verbose=True):
+    """Print the comparison of both parsers on one receipt"""
+    
+    if verbose:
+        print("\n" + "=" * 70)
+        print(f"📄 Testing: {filepath}")
+        print("=" * 70)
+        
+        receipt_text = load_receipt(filepath)
+        print("\n📝 Original Receipt:")
+        print("-" * 70)
+        preview = receipt_text[:150] + "..." if len(receipt_text) > 150 else receipt_text
+        print(preview)
+        print("-" * 70)
+        
+        print("\n🔧 REGEX PARSER:")
+        print("-" * 70)
+        print_parser_result(results['regex'])
+        
+        print("\n🤖 LLM PARSER:")
+        print("-" * 70)
+        print_parser_result(results['llm'])
+    
     # Comparison Summary (same for both verbose and quiet)
     if not verbose:
         # In quiet mode, show filename first
@@ -126,8 +125,6 @@ def compare_parsers(filepath, verbose=True):
         print("=" * 70)
     else:
         print("-" * 70)
-    
-    return results
 
 def list_test_files(test_data_dir="test_data"):
     """List all available test files"""
@@ -142,7 +139,7 @@ def list_test_files(test_data_dir="test_data"):
     
     return files
 
-def run_tests(files=None, test_data_dir="test_data", verbose=True):
+async def run_tests(files=None, test_data_dir="test_data", verbose=True, concurrency=CONCURRENCY):
     """Run tests on specified files or all files"""
     
     test_data_path = Path(test_data_dir)
@@ -167,8 +164,18 @@ def run_tests(files=None, test_data_dir="test_data", verbose=True):
         'total_receipt_amount': 0.0
     }
     
-    for filepath in test_files:
-        results = compare_parsers(filepath, verbose=verbose)
+    # Parse all files concurrently, then print in file order so the
+    # output of different receipts doesn't interleave
+    sem = asyncio.Semaphore(concurrency)
+    
+    async def bounded(filepath):
+        async with sem:
+            return await compare_parsers(filepath)
+    
+    all_results = await asyncio.gather(*[bounded(fp) for fp in test_files])
+    
+    for filepath, results in zip(test_files, all_results):
+        print_comparison(filepath, results, verbose=verbose)
         
         # Update summary
         if results['regex']['success']:
@@ -200,6 +207,6 @@ if __name__ == "__main__":
     if args.list:
         list_test_files()
     elif args.all or not args.files:
-        run_tests(verbose=not args.quiet)
+        asyncio.run(run_tests(verbose=not args.quiet))
     else:
-        run_tests(args.files, verbose=not args.quiet)
\ No newline at end of file
+        asyncio.run(run_tests(args.files, verbose=not args.quiet))
\ No newline at end of file
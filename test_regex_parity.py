@@ -0,0 +1,92 @@
+import random
+import re
+from pathlib import Path
+
+from parsers.regex_parser import parse_receipt
+
+
+def reference_parse_receipt(receipt_text):
+    """Original one-search-per-field implementation, kept as the parity reference"""
+
+    result = {
+        "merchant": None,
+        "date": None,
+        "invoice_number": None,
+        "items": [],
+        "subtotal": None,
+        "tax": None,
+        "total": None,
+        "parser_used": "regex"
+    }
+
+    lines = receipt_text.strip().split('\n')
+
+    for line in lines:
+        if line.strip():
+            result["merchant"] = line.strip()
+            break
+
+    date_match = re.search(r"Date:\s*(.+)", receipt_text)
+    if date_match:
+        result["date"] = date_match.group(1).strip()
+
+    invoice_match = re.search(r"Invoice #:\s*(.+)", receipt_text)
+    if invoice_match:
+        result["invoice_number"] = invoice_match.group(1).strip()
+
+    total_match = re.search(r"TOTAL:\s*\$(\d+\.\d+)", receipt_text)
+    if total_match:
+        result["total"] = float(total_match.group(1))
+
+    subtotal_match = re.search(r"Subtotal:\s*\$(\d+\.\d+)", receipt_text)
+    if subtotal_match:
+        result["subtotal"] = float(subtotal_match.group(1))
+
+    tax_match = re.search(r"Tax.*?:\s*\$(\d+\.\d+)", receipt_text)
+    if tax_match:
+        result["tax"] = float(tax_match.group(1))
+
+    for line in lines:
+        if line.strip().startswith('-'):
+            item_match = re.search(r'-\s*(.+?)\s*\.\.\.\s*\$(\d+\.\d+)', line)
+            if item_match:
+                result["items"].append({
+                    "description": item_match.group(1).strip(),
+                    "amount": float(item_match.group(2))
+                })
+
+    return result
+
+
+FRAGMENTS = [
+    "Date:", "Invoice #:", "TOTAL:", "Subtotal:", "Tax", "Tax (8%):", ":",
+    "$", "$12.50", "71.81", "2024-01-15", "INV-7", "- ", "-", "...", " ... ",
+    "Pens", "Shop", " ", "  ", "\t", "\n", "\n\n", "\r\n",
+]
+
+
+def random_receipt(rng):
+    return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 40)))
+
+
+def test_regex_parity(iterations=20000, seed=0):
+    samples = [path.read_text() for path in sorted(Path("test_data").rglob("*.txt"))]
+    samples += [
+        "Shop\nDate: 2024-01-15   Invoice #: INV-77\nTOTAL: $5.00",
+        "Shop\nDate:\nTOTAL: $5.00",
+        "Shop\nTax: Subtotal: $3.00 TOTAL: $4.00",
+    ]
+    rng = random.Random(seed)
+    samples += [random_receipt(rng) for _ in range(iterations)]
+
+    for receipt_text in samples:
+        expected = reference_parse_receipt(receipt_text)
+        actual = parse_receipt(receipt_text)
+        assert actual == expected, f"Mismatch for {receipt_text!r}:\n{actual}\n!=\n{expected}"
+
+    return len(samples)
+
+
+if __name__ == "__main__":
+    count = test_regex_parity()
+    print(f"✅ regex parser matches the reference on {count} receipts")